@@ -1,65 +1,545 @@
-from flask import Flask, request, jsonify, redirect  # Import Flask components for building the web app.
-from flask_cors import CORS  # Import CORS to enable cross-origin resource sharing.
-import spotipy  # Import Spotipy to interact with the Spotify API.
-from spotipy.oauth2 import SpotifyOAuth  # Import SpotifyOAuth for managing Spotify authentication.
+from quart import Quart, request, redirect, g  # Import Quart components for building the async web app.
+from quart.utils import run_sync  # Import run_sync to run blocking calls without stalling the event loop.
+from quart_cors import cors  # Import cors to enable cross-origin resource sharing.
+import httpx  # Import httpx to call the Spotify Web API asynchronously over HTTP/2.
+import orjson  # Import orjson for fast JSON parsing and serialization.
+from spotipy.oauth2 import SpotifyOAuth, SpotifyOauthError  # Import SpotifyOAuth for managing Spotify authentication.
+from spotipy.cache_handler import RedisCacheHandler  # Import RedisCacheHandler to store OAuth tokens in Redis instead of the local .cache file.
+import redis  # Import redis to share the OAuth token between worker processes.
+from redis import asyncio as aioredis  # Import the asyncio Redis client used for the response cache.
+import requests  # Import requests to give the OAuth manager a pooled HTTP session.
+from requests.adapters import HTTPAdapter  # Import HTTPAdapter to size the connection pool.
+from urllib3.util.retry import Retry  # Import Retry to back off on transient Spotify errors.
+from typing import Annotated  # Import Annotated to attach validation rules to a type.
+from pydantic import BaseModel, Field, ValidationError  # Import pydantic to validate JSON request bodies.
 from dotenv import load_dotenv  # Import load_dotenv to load environment variables from a .env file.
 import os  # Import os to access environment variables.
+import asyncio  # Import asyncio to run several Spotify calls concurrently.
+import threading  # Import threading to guard the in-process token cache.
+import time  # Import time to check when the cached token expires.
+from operator import itemgetter  # Import itemgetter to pull several fields out of a dict in one call.
+from filelock import FileLock  # Import FileLock to serialize access to the .cache file across worker processes.
+import re  # Import re to check track IDs passed in URLs.
+from functools import wraps  # Import wraps to keep handler names intact when decorating them.
+import hashlib  # Import hashlib to derive a per-account cache key from the refresh token.
 
 # Load environment variables from the .env file.
 load_dotenv()  # This reads the .env file and adds the variables to the environment.
 
 # Retrieve the Spotify API credentials from the environment variables.
-SPOTIPY_CLIENT_ID = os.getenv('SPOTIPY_CLIENT_ID')  
+SPOTIPY_CLIENT_ID = os.getenv('SPOTIPY_CLIENT_ID')
 SPOTIPY_CLIENT_SECRET = os.getenv('SPOTIPY_CLIENT_SECRET')
 SPOTIPY_REDIRECT_URI = os.getenv('SPOTIPY_REDIRECT_URI')
+# Optional Redis URL; when set, the OAuth token is shared through Redis instead of the local .cache file.
+REDIS_URL = os.getenv('REDIS_URL')
+# Redis key holding the OAuth token.
+TOKEN_CACHE_KEY = 'spotify:token:default'
+# Lock taken by the worker reading or refreshing the shared token (a Redis key, or a file next to .cache
+# without Redis), and how long (in seconds) it may be held or waited for.
+TOKEN_REFRESH_LOCK_KEY = 'spotify:token:default:refresh-lock'
+TOKEN_REFRESH_LOCK_TIMEOUT = 30
 
-# Create the Flask application instance.
-app = Flask(__name__)
+# Permissions requested from the user during the OAuth flow.
+SPOTIFY_SCOPES = (
+    'user-library-read',
+    'user-library-modify',
+    'user-read-playback-state',
+    'user-modify-playback-state',
+)
+SPOTIFY_SCOPE = ' '.join(SPOTIFY_SCOPES)
+
+# Prefix turning a bare track ID into a Spotify track URI.
+_SPOTIFY_TRACK_URI_PREFIX = 'spotify:track:'
+# Matches a well-formed Spotify track ID (22 base-62 characters), bare or as a track URI.
+TRACK_ID_PATTERN = r'^(spotify:track:)?[A-Za-z0-9]{22}$'
+_match_track_id = re.compile(TRACK_ID_PATTERN).match
+
+# Base URL for every Spotify Web API call made by this app.
+SPOTIFY_API_BASE = 'https://api.spotify.com/v1'
+
+# Spotify's "Get Several Tracks" endpoint accepts at most 50 IDs per call.
+TRACKS_BATCH_SIZE = 50
+# Maximum number of batch calls in flight at once, to stay clear of Spotify's rate limits.
+TRACKS_MAX_CONCURRENCY = 4
+# Maximum number of IDs a single /tracks request may ask for.
+TRACKS_MAX_IDS = 500
+
+# Getters for the fields /search keeps from each track, its album and its artists.
+_TRACK_KEYS = itemgetter("id", "name", "href", "uri", "preview_url", "popularity", "duration_ms")
+# Album and artist fields are copied under the same names, so the output dicts are built
+# straight from these tuples with dict(zip(...)).
+_ALBUM_FIELDS = ("id", "name", "release_date", "total_tracks", "images", "href")
+_ARTIST_FIELDS = ("id", "name", "href")
+_ALBUM_KEYS = itemgetter(*_ALBUM_FIELDS)
+_ARTIST_KEYS = itemgetter(*_ARTIST_FIELDS)
+
+# Connection pool size for calls to Spotify, and how transient failures are retried.
+SPOTIFY_POOL_SIZE = 50
+SPOTIFY_MAX_RETRIES = 3
+SPOTIFY_BACKOFF_FACTOR = 0.3
+SPOTIFY_RETRY_STATUSES = (429, 502, 503)
+# Gateway errors may arrive after Spotify already applied a change, so they are only retried
+# for idempotent methods; POSTs such as queueing a track would otherwise be applied twice.
+SPOTIFY_GATEWAY_STATUSES = (502, 503)
+SPOTIFY_IDEMPOTENT_METHODS = frozenset({'GET', 'PUT'})
+# Longest Retry-After (in seconds) worth waiting for inside a request; beyond that the 429 is returned.
+SPOTIFY_MAX_RETRY_AFTER = 10
+
+# How long (in seconds) cached GET responses are served from Redis before asking Spotify again.
+# Search results and playlists change often; track metadata is close to immutable.
+SEARCH_CACHE_TTL = 60
+TRACK_CACHE_TTL = 600
+PLAYLISTS_CACHE_TTL = 60
+
+# How long ETags and bodies of Spotify GET responses are kept for conditional requests.
+# Kept well past the response cache TTLs, so a response-cache miss can still be revalidated with a 304.
+ETAG_CACHE_TTL = 6 * max(SEARCH_CACHE_TTL, TRACK_CACHE_TTL, PLAYLISTS_CACHE_TTL)
+
+# Spotify returns at most 50 playlists per page; up to 5 pages are fetched at once.
+PLAYLISTS_PAGE_SIZE = 50
+PLAYLISTS_MAX_CONCURRENCY = 5
+
+# Create the Quart application instance.
+app = Quart(__name__)
 # Enable CORS for the app to allow requests from different origins.
-CORS(app)
+app = cors(app)
+
+# Shared by every /tracks request in this process, so the limit applies to the total
+# number of batch calls in flight rather than to each request separately.
+_tracks_semaphore = asyncio.Semaphore(TRACKS_MAX_CONCURRENCY)
+# Likewise shared by every /playlists request, bounding the total page requests in flight.
+_playlists_semaphore = asyncio.BoundedSemaphore(PLAYLISTS_MAX_CONCURRENCY)
 
 # Now, these credentials are loaded dynamically from your .env file,
 # ensuring that sensitive information isn't hard-coded in your source code.
 
+
+# Use Redis for the token cache when configured, so every worker process (and host) sees the same token;
+# otherwise Spotipy falls back to its .cache file.
+token_redis = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+cache_handler = RedisCacheHandler(token_redis, key=TOKEN_CACHE_KEY) if token_redis else None
+
+# Async Redis connection for the response cache; caching is disabled when REDIS_URL is not set.
+redis_conn = aioredis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+# Keep-alive session with a larger pool and retries for the OAuth manager's token requests.
+# Token requests are POSTs, which urllib3 does not retry unless they are listed in allowed_methods.
+oauth_session = requests.Session()
+oauth_session.mount('https://', HTTPAdapter(
+    pool_connections=SPOTIFY_POOL_SIZE,
+    pool_maxsize=SPOTIFY_POOL_SIZE,
+    max_retries=Retry(total=SPOTIFY_MAX_RETRIES, backoff_factor=SPOTIFY_BACKOFF_FACTOR,
+                      status_forcelist=SPOTIFY_RETRY_STATUSES, allowed_methods=frozenset({'POST'}))
+))
+
 # Create a SpotifyOAuth instance to handle the OAuth flow.
 # The scope defines the permissions your application is requesting.
 sp_oauth = SpotifyOAuth(
     client_id=SPOTIPY_CLIENT_ID,
     client_secret=SPOTIPY_CLIENT_SECRET,
     redirect_uri=SPOTIPY_REDIRECT_URI,
-    scope="user-library-read user-library-modify user-read-playback-state user-modify-playback-state"
+    scope=SPOTIFY_SCOPE,
+    cache_handler=cache_handler,
+    requests_session=oauth_session
 )
 
-# Instantiate the Spotipy client using the SpotifyOAuth manager.
-# Note: This client will later use the cached token provided by our custom OAuth endpoints.
-sp = spotipy.Spotify(auth_manager=sp_oauth)
+# The authorization URL only depends on the configuration above, so build it once at startup.
+# A reverse proxy can serve the same redirect directly, e.g. nginx `location = /login { return 302 <AUTH_URL>; }`.
+AUTH_URL = sp_oauth.get_authorize_url()
+
+# Without Redis, every worker process shares the .cache file; this lock keeps one worker from
+# reading it while another is rewriting it.
+token_file_lock = None if token_redis else FileLock(sp_oauth.cache_handler.cache_path + '.lock',
+                                                    timeout=TOKEN_REFRESH_LOCK_TIMEOUT)
+
+
+# A track ID or track URI; every endpoint taking tracks accepts both forms.
+TrackId = Annotated[str, Field(pattern=TRACK_ID_PATTERN)]
+
+
+class PlaylistTracksRequest(BaseModel):
+    """
+    JSON body for POST /playlists/<id>/tracks: track IDs (or URIs) to add.
+    """
+    track_ids: list[TrackId] = Field(min_length=1)
+
+
+class PlayRequest(BaseModel):
+    """
+    JSON body for PUT /play: the ID (or URI) of the track to play.
+    """
+    track_id: TrackId
+
+
+class QueueRequest(BaseModel):
+    """
+    JSON body for POST /queue: the ID (or URI) of the track to queue.
+    """
+    track_id: TrackId
+
+
+class SpotifyAPIError(Exception):
+    """
+    Raised when the Spotify Web API answers with an error status code.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(f'http status: {status}, message: {message}')
+        self.status = status
+        self.message = message
+
+
+@app.before_serving
+async def create_client():
+    """
+    Open a single HTTP/2 httpx client when the server starts.
+    All handlers share it, so concurrent calls to api.spotify.com are multiplexed over kept-alive connections.
+    """
+    app.spotify_client = httpx.AsyncClient(
+        base_url=SPOTIFY_API_BASE,
+        http2=True,
+        limits=httpx.Limits(max_connections=SPOTIFY_POOL_SIZE)
+    )
+
+
+@app.after_serving
+async def close_client():
+    """
+    Close the shared httpx client when the server shuts down.
+    """
+    await app.spotify_client.aclose()
+
+
+@app.before_serving
+async def start_token_refresher():
+    """
+    Start refreshing the OAuth token in the background, so requests never wait on a refresh.
+    """
+    app.token_refresher = asyncio.ensure_future(refresh_token_periodically())
+
+
+@app.after_serving
+async def stop_token_refresher():
+    """
+    Stop the background token refresh when the server shuts down.
+    """
+    app.token_refresher.cancel()
+
+
+async def refresh_token_periodically():
+    """
+    Refresh the token TOKEN_REFRESH_LEAD seconds before it expires.
+    Since the in-process copy then never goes stale, require_authentication stays on its fast path.
+    Only the token this process has loaded is refreshed; until a request loads one, the task just waits.
+    """
+    while True:
+        try:
+            token_info = _TOKEN_CACHE["info"]
+            # Sleep until the token is due for a refresh, waking up periodically to notice new logins.
+            delay = token_info["expires_at"] - TOKEN_REFRESH_LEAD - time.time() if token_info else TOKEN_REFRESH_POLL_INTERVAL
+            if delay > 0:
+                await asyncio.sleep(min(delay, TOKEN_REFRESH_POLL_INTERVAL))
+                continue
+            await run_sync(refresh_shared_token)(token_info)
+        except SpotifyOauthError as e:
+            # The refresh token was rejected (e.g. revoked): drop it, like handle_oauth_error does,
+            # and wait for the user to log in again instead of retrying it forever.
+            app.logger.warning('Refresh token rejected, waiting for a new login: %s', e)
+            store_token(None)
+        except Exception:
+            # Any failure (OAuth, network, Redis) must not end the task; leave the current token in place,
+            # let requests fall back to refreshing it on demand, and try again later.
+            app.logger.exception('Background token refresh failed')
+            await asyncio.sleep(TOKEN_REFRESH_POLL_INTERVAL)
+
+
+def shared_token_lock():
+    """
+    Return the lock that serializes reading and refreshing the token across worker processes:
+    a Redis lock when Redis is configured, otherwise a file lock next to the .cache file.
+    """
+    if token_redis:
+        return token_redis.lock(TOKEN_REFRESH_LOCK_KEY, timeout=TOKEN_REFRESH_LOCK_TIMEOUT,
+                                blocking_timeout=TOKEN_REFRESH_LOCK_TIMEOUT)
+    return token_file_lock
+
+
+def refresh_shared_token(token_info):
+    """
+    Refresh the token unless another worker process already has.
+    The shared token lock makes the workers take turns; each one then re-reads the shared cache and adopts a newer token instead of exchanging the refresh token again.
+    _TOKEN_LOCK is always taken first, so threads of this process never wait on each other in the opposite order.
+    """
+    with _TOKEN_LOCK, shared_token_lock():
+        shared_token = sp_oauth.cache_handler.get_cached_token()
+        if shared_token and shared_token['expires_at'] > token_info['expires_at']:
+            store_token(shared_token)
+            return shared_token
+        return refresh_token(token_info)
+
+
+def replace_rejected_token(token_info):
+    """
+    Return a new token after Spotify rejected `token_info` with a 401.
+    Concurrent calls rejected with the same token share one refresh: whoever gets the lock
+    first refreshes, and the others reuse the token it stored.
+    """
+    with _TOKEN_LOCK:
+        current = _TOKEN_CACHE["info"]
+        if current and current["access_token"] != token_info["access_token"]:
+            return current
+        return refresh_shared_token(token_info)
+
+
+def refresh_token(token_info):
+    """
+    Exchange the refresh token for a new access token and keep it in the in-process cache.
+    """
+    token_info = sp_oauth.refresh_access_token(token_info['refresh_token'])
+    store_token(token_info)
+    return token_info
+
+
+def account_key(token_info):
+    """
+    Identify the logged-in account in Redis keys.
+    The refresh token identifies the account; it is hashed so it never appears in Redis.
+    """
+    return hashlib.sha256(token_info['refresh_token'].encode()).hexdigest()[:16]
+
+
+def retry_delay(method, response, attempt):
+    """
+    Return how many seconds to wait before retrying `response`, or None if it must not be retried.
+    """
+    backoff = SPOTIFY_BACKOFF_FACTOR * 2 ** attempt
+    if response.status_code == 429:
+        # A rate-limited request was not processed, so any method can be retried, but never sooner
+        # than Spotify asks; if that is too long to hold the request open, give up instead.
+        try:
+            retry_after = int(response.headers.get('Retry-After', 0))
+        except ValueError:
+            retry_after = 0
+        return max(backoff, retry_after) if retry_after <= SPOTIFY_MAX_RETRY_AFTER else None
+    if response.status_code in SPOTIFY_GATEWAY_STATUSES and method in SPOTIFY_IDEMPOTENT_METHODS:
+        return backoff
+    return None
+
+
+async def spotify_request(method, path, token_info, **kwargs):
+    """
+    Send a request to the Spotify Web API using the shared httpx client.
+    - method: HTTP method, e.g. 'GET' or 'POST'.
+    - path: API path relative to SPOTIFY_API_BASE, e.g. '/search'.
+    - token_info: The cached token details whose access token is sent as the bearer token.
+    Any extra keyword arguments (params, json, ...) are passed on to httpx.
+    Returns the decoded JSON body, or None when Spotify answers without a body.
+    Rate-limited (429) responses are retried after Spotify's Retry-After delay, gateway (502/503)
+    responses to GET and PUT are retried with exponential backoff, and a 401 (token revoked or expired early) triggers one token refresh before retrying.
+    When Redis is configured, GET responses are revalidated with their ETag, so an unchanged
+    resource comes back as an empty 304 and the stored body is reused.
+    """
+    etag_key, cached_entry = None, {}
+    if method == 'GET' and redis_conn is not None:
+        etag_key = f"etag:{account_key(token_info)}:{path}?{httpx.QueryParams(kwargs.get('params'))}"
+        cached_entry = await redis_conn.hgetall(etag_key)
+
+    attempt, refreshed = 0, False
+    # Every pass either returns, raises, or consumes the single refresh or one of the retries.
+    while True:
+        headers = {'Authorization': f"Bearer {token_info['access_token']}"}
+        if cached_entry:
+            headers['If-None-Match'] = cached_entry[b'etag'].decode()
+        response = await app.spotify_client.request(method, path, headers=headers, **kwargs)
+        if response.status_code == 304 and cached_entry:
+            # Not modified: reuse the body stored alongside the ETag.
+            return orjson.loads(cached_entry[b'body'])
+        try:
+            # Playback endpoints answer with an empty 202/204 response on success.
+            data = orjson.loads(response.content) if response.content else None
+        except orjson.JSONDecodeError:
+            # Gateway errors may come back as HTML rather than JSON.
+            data = None
+        if response.status_code == 401 and not refreshed:
+            # The refresh gets its own pass and does not count against the retries.
+            # If the refresh token itself is rejected, handle_oauth_error answers with a 401.
+            token_info = await run_sync(replace_rejected_token)(token_info)
+            refreshed = True
+            continue
+        delay = retry_delay(method, response, attempt) if attempt < SPOTIFY_MAX_RETRIES else None
+        if delay is not None:
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        if response.status_code >= 400:
+            # Spotify wraps error details as {"error": {"status": ..., "message": ...}}.
+            error = data.get('error') if isinstance(data, dict) else None
+            message = error.get('message', response.reason_phrase) if isinstance(error, dict) else response.reason_phrase
+            raise SpotifyAPIError(response.status_code, message)
+        if etag_key and 'ETag' in response.headers:
+            # Remember the ETag and body so the next identical GET can be sent conditionally.
+            # Both commands run in one transaction, so the hash never exists without its TTL.
+            async with redis_conn.pipeline(transaction=True) as pipe:
+                pipe.hset(etag_key, mapping={'etag': response.headers['ETag'], 'body': response.content})
+                pipe.expire(etag_key, ETAG_CACHE_TTL)
+                await pipe.execute()
+        return data
+
+
+@app.errorhandler(SpotifyOauthError)
+async def handle_oauth_error(error):
+    """
+    A token could not be refreshed (e.g. the refresh token was revoked), so the user has to log in again.
+    """
+    # Drop the in-process copy so the next request re-reads the OAuth cache.
+    store_token(None)
+    return fastjson({'error': 'User not authenticated. Please log in via /login.'}, 401)
+
+
+def fastjson(obj, status=200):
+    """
+    Build a JSON response with orjson, which serializes much faster than jsonify.
+    """
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
+
+
+def invalid_body(error):
+    """
+    Build the 400 response for a request body that failed validation.
+    """
+    # The raw input is left out: it may be undecodable bytes, and the client already has its own body.
+    details = error.errors(include_url=False, include_context=False, include_input=False)
+    return fastjson({'error': 'Invalid request body', 'details': details}, 400)
+
+
+def bare_track_id(track_id):
+    """
+    Return the bare ID for a track ID or track URI, or None when it is malformed.
+    """
+    return track_id.removeprefix(_SPOTIFY_TRACK_URI_PREFIX) if _match_track_id(track_id) else None
+
+
+def track_uri(track_id):
+    """
+    Convert a bare Spotify track ID into a track URI; URIs are returned unchanged.
+    """
+    return track_id if track_id.startswith('spotify:') else _SPOTIFY_TRACK_URI_PREFIX + track_id
+
+
+# In-process copy of the token, so most requests skip reading the OAuth cache file.
+# "exp" mirrors the token's expires_at timestamp; 0 means nothing is cached yet.
+_TOKEN_CACHE = {"info": None, "exp": 0}
+# Seconds before expiry at which the in-process copy is considered stale.
+TOKEN_EXPIRY_MARGIN = 60
+# The background task refreshes the token this many seconds before it expires,
+# and re-checks at least this often so a newly authenticated token is picked up.
+TOKEN_REFRESH_LEAD = 120
+TOKEN_REFRESH_POLL_INTERVAL = 60
+# Guards _TOKEN_CACHE, since cache misses are handled on worker threads.
+# Re-entrant so load_token can call store_token while holding it.
+_TOKEN_LOCK = threading.RLock()
+
+
+def store_token(token_info):
+    """
+    Remember the given token details in the in-process cache.
+    """
+    with _TOKEN_LOCK:
+        _TOKEN_CACHE["info"] = token_info
+        _TOKEN_CACHE["exp"] = token_info["expires_at"] if token_info else 0
+
+
+def load_token():
+    """
+    Return the token details, reading the OAuth cache only when the in-process copy is stale.
+    The lock is held while reading (and possibly refreshing), so only one thread refreshes an expired token.
+    """
+    with _TOKEN_LOCK:
+        # Another thread may have refreshed the token while we were waiting for the lock.
+        if time.time() < _TOKEN_CACHE["exp"] - TOKEN_EXPIRY_MARGIN:
+            return _TOKEN_CACHE["info"]
+        with shared_token_lock():
+            token_info = sp_oauth.get_cached_token()  # Check the cache for a valid token (refreshing it if expired).
+        store_token(token_info)
+        return token_info
+
 
-def require_authentication():
+async def require_authentication():
     """
     Helper function to check whether a valid token exists.
     Returns a tuple (authenticated, token_info):
       - authenticated: Boolean indicating if a valid token is available.
       - token_info: The token details if available, or None otherwise.
     """
-    token_info = sp_oauth.get_cached_token()  # Check the cache for a valid token.
+    # Fast path: the in-process copy is still valid, so no file access is needed.
+    if time.time() < _TOKEN_CACHE["exp"] - TOKEN_EXPIRY_MARGIN:
+        return True, _TOKEN_CACHE["info"]
+    # Reading the cache (and refreshing an expired token) is blocking, so run it off the event loop.
+    token_info = await run_sync(load_token)()
     if not token_info:
         # No valid token is available.
         return False, None
     return True, token_info
 
+# Endpoints that can be reached without a Spotify token.
+_PUBLIC_ENDPOINTS = {'login', 'callback', 'static'}
+
+
+@app.before_request
+async def check_authentication():
+    """
+    Reject requests to protected endpoints when no valid token is available.
+    The token is stored on g.token_info so handlers can use it without checking again.
+    """
+    # Public endpoints, unknown URLs (left to 404) and CORS preflight requests do not need a token.
+    if request.endpoint is None or request.endpoint in _PUBLIC_ENDPOINTS or request.method == 'OPTIONS':
+        return None
+    authenticated, token_info = await require_authentication()
+    if not authenticated:
+        # If not authenticated, instruct the user to log in.
+        return fastjson({'error': 'User not authenticated. Please log in via /login.'}, 401)
+    g.token_info = token_info
+    return None
+
+
+def cached(ttl):
+    """
+    Decorator that caches a GET endpoint's successful JSON responses in Redis for `ttl` seconds.
+    Responses are keyed by handler name, the logged-in account and the full request path (including
+    the query string), so a different account logging in never sees the previous account's data.
+    Unauthenticated requests are rejected by check_authentication before reaching the cache.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if redis_conn is None:
+                return await fn(*args, **kwargs)
+
+            key = f'response:{fn.__name__}:{account_key(g.token_info)}:{request.full_path}'
+            data = await redis_conn.get(key)
+            if data is not None:
+                # Cache hit: serve the stored body without calling Spotify.
+                return app.response_class(data, mimetype='application/json')
+
+            response = await fn(*args, **kwargs)
+            # Only cache successful responses; errors should be retried on the next request.
+            if response.status_code == 200:
+                await redis_conn.setex(key, ttl, await response.get_data())
+            return response
+        return wrapper
+    return decorator
+
 @app.route('/login')
-def login():
+async def login():
     """
     Endpoint to initiate the Spotify OAuth authentication process.
     This redirects the user to Spotify's authorization page.
     """
-    # Generate the Spotify authorization URL using our OAuth manager.
-    auth_url = sp_oauth.get_authorize_url()
-    # Redirect the user to Spotify's login/authorization page.
-    return redirect(auth_url)
+    # Redirect the user to Spotify's login/authorization page, using the URL built at startup.
+    return redirect(AUTH_URL)
 
 @app.route('/callback')
-def callback():
+async def callback():
     """
     OAuth callback endpoint.
     Spotify will redirect the user to this URL after they authorize your app.
@@ -71,182 +551,248 @@ def callback():
     error = request.args.get('error')
     if error:
         # If there is an error, return it as a JSON response with a 400 status code.
-        return jsonify({'error': error}), 400
+        return fastjson({'error': error}, 400)
     if code:
         # Exchange the authorization code for an access token.
-        token_info = sp_oauth.get_access_token(code)
+        token_info = await run_sync(exchange_code)(code)
         if token_info:
             # If successful, inform the client that authentication is complete.
-            return jsonify({'status': 'Authenticated successfully.'})
+            return fastjson({'status': 'Authenticated successfully.'})
     # If we reach here, authentication failed unexpectedly.
-    return jsonify({'error': 'Authentication failed.'}), 400
+    return fastjson({'error': 'Authentication failed.'}, 400)
+
+def exchange_code(code):
+    """
+    Exchange an authorization code for a token, writing the shared cache under the shared token lock.
+    """
+    with _TOKEN_LOCK, shared_token_lock():
+        token_info = sp_oauth.get_access_token(code)
+    if token_info:
+        # Keep the new token in-process so the next request does not re-read the cache file.
+        store_token(token_info)
+    return token_info
 
 @app.route('/search', methods=['GET'])
-def search_songs():
+@cached(SEARCH_CACHE_TTL)
+async def search_songs():
     """
     Endpoint to search for songs on Spotify based on a query parameter.
     Returns only the important information for each track.
     """
-    # Verify that the user is authenticated by checking for a valid token.
-    authenticated, _ = require_authentication()
-    if not authenticated:
-        # If not authenticated, instruct the user to log in.
-        return jsonify({'error': 'User not authenticated. Please log in via /login.'}), 401
+    # The token was checked and stored on g by check_authentication.
+    token_info = g.token_info
 
     # Retrieve the query parameter 'q' from the request URL.
     query = request.args.get('q')
     if not query:
         # Return an error if the query parameter is missing.
-        return jsonify({'error': 'Missing query parameter'}), 400
+        return fastjson({'error': 'Missing query parameter'}, 400)
 
-    # Use the Spotify API to search for tracks matching the provided query.
-    results = sp.search(q=query, type='track')
+    try:
+        # Use the Spotify API to search for tracks matching the provided query.
+        results = await spotify_request('GET', '/search', token_info, params={'q': query, 'type': 'track'})
+    except SpotifyAPIError as e:
+        return fastjson({'error': str(e)}, 400)
 
     # Extract the list of track items from the API response.
     tracks = results.get("tracks", {}).get("items", [])
     simplified_tracks = []
 
     # Loop through each track in the result and extract the most important details.
+    # Spotify always includes these fields, so they are read directly with the pre-built getters.
     for track in tracks:
+        track_id, name, href, uri, preview_url, popularity, duration_ms = _TRACK_KEYS(track)
         # Construct a dictionary with key details for each track.
         track_info = {
-            "id": track.get("id"),  # Unique track identifier.
-            "name": track.get("name"),  # Name of the track.
-            "artists": [  # List of artists for the track.
-                {
-                    "id": artist.get("id"),  # Unique artist identifier.
-                    "name": artist.get("name"),  # Name of the artist.
-                    "href": artist.get("href")  # Link to the artist's Spotify profile.
-                } for artist in track.get("artists", [])
+            "id": track_id,  # Unique track identifier.
+            "name": name,  # Name of the track.
+            "artists": [  # List of artists for the track (id, name and link to the artist's profile).
+                dict(zip(_ARTIST_FIELDS, _ARTIST_KEYS(artist))) for artist in track["artists"]
             ],
-            "album": {  # Album information.
-                "id": track.get("album", {}).get("id"),  # Unique album identifier.
-                "name": track.get("album", {}).get("name"),  # Album name.
-                "release_date": track.get("album", {}).get("release_date"),  # Album release date.
-                "total_tracks": track.get("album", {}).get("total_tracks"),  # Total number of tracks in the album.
-                "images": track.get("album", {}).get("images"),  # List of album cover images.
-                "href": track.get("album", {}).get("href"),  # Link to the album's Spotify page.
-            },
-            "href": track.get("href"),  # API endpoint for this track.
-            "uri": track.get("uri"),  # Spotify URI for this track.
-            "preview_url": track.get("preview_url"),  # URL to a 30-second preview of the track.
-            "popularity": track.get("popularity"),  # Popularity score of the track.
-            "duration_ms": track.get("duration_ms")  # Duration of the track in milliseconds.
+            # Album information: id, name, release date, total tracks, cover images and link.
+            "album": dict(zip(_ALBUM_FIELDS, _ALBUM_KEYS(track["album"]))),
+            "href": href,  # API endpoint for this track.
+            "uri": uri,  # Spotify URI for this track.
+            "preview_url": preview_url,  # URL to a 30-second preview of the track.
+            "popularity": popularity,  # Popularity score of the track.
+            "duration_ms": duration_ms  # Duration of the track in milliseconds.
         }
         # Add the simplified track information to our list.
         simplified_tracks.append(track_info)
 
     # Return the list of simplified track details as a JSON response.
-    return jsonify(simplified_tracks)
+    return fastjson(simplified_tracks)
 
 
 @app.route('/track/<id>', methods=['GET'])
-def get_track_details(id):
+@cached(TRACK_CACHE_TTL)
+async def get_track_details(id):
     """
     Endpoint to retrieve detailed information about a specific track using its Spotify ID.
+    Deprecated: use /tracks?ids=... to look up several tracks in a single request.
     """
-    # Ensure the user is authenticated.
-    authenticated, _ = require_authentication()
-    if not authenticated:
-        return jsonify({'error': 'User not authenticated. Please log in via /login.'}), 401
+    # The token was checked and stored on g by check_authentication.
+    token_info = g.token_info
+
+    # Accept a track URI as well as a bare ID, and reject malformed IDs before calling Spotify.
+    track_id = bare_track_id(id)
+    if track_id is None:
+        return fastjson({'error': 'Invalid track id'}, 400)
 
     try:
-        # Use the Spotify API client to fetch track details.
-        track = sp.track(id)
-        return jsonify(track)
-    except spotipy.exceptions.SpotifyException as e:
+        # Use the Spotify API to fetch track details.
+        track = await spotify_request('GET', f'/tracks/{track_id}', token_info)
+        return fastjson(track)
+    except SpotifyAPIError as e:
         # If an error occurs (e.g., invalid track ID), return an error message.
-        return jsonify({'error': str(e)}), 400
+        return fastjson({'error': str(e)}, 400)
+
+@app.route('/tracks', methods=['GET'])
+@cached(TRACK_CACHE_TTL)
+async def get_several_tracks():
+    """
+    Endpoint to retrieve detailed information about several tracks in one request.
+    The track IDs are passed as a comma-separated 'ids' query parameter, e.g. /tracks?ids=a,b,c.
+    Prefer this over calling /track/<id> once per track: every 50 IDs cost a single Spotify call.
+    """
+    # The token was checked and stored on g by check_authentication.
+    token_info = g.token_info
+
+    # Split the comma-separated IDs, ignoring empty entries.
+    track_ids = [track_id for track_id in request.args.get('ids', '').split(',') if track_id]
+    if not track_ids:
+        return fastjson({'error': 'Missing ids parameter'}, 400)
+    if len(track_ids) > TRACKS_MAX_IDS:
+        return fastjson({'error': f'Too many ids (at most {TRACKS_MAX_IDS} per request)'}, 400)
+    # Normalize URIs to bare IDs; one malformed ID would make Spotify reject its whole batch.
+    track_ids = [bare_track_id(track_id) for track_id in track_ids]
+    if None in track_ids:
+        return fastjson({'error': 'Invalid track id in ids parameter'}, 400)
+
+    async def fetch_batch(batch):
+        async with _tracks_semaphore:
+            results = await spotify_request('GET', '/tracks', token_info, params={'ids': ','.join(batch)})
+            return results.get('tracks', [])
+
+    try:
+        # Fetch every batch of up to 50 IDs concurrently, keeping the order of the requested IDs.
+        batches = await asyncio.gather(*(
+            fetch_batch(track_ids[i:i + TRACKS_BATCH_SIZE])
+            for i in range(0, len(track_ids), TRACKS_BATCH_SIZE)
+        ))
+    except SpotifyAPIError as e:
+        return fastjson({'error': str(e)}, 400)
+
+    # Flatten the batches back into a single list of tracks.
+    return fastjson({'tracks': [track for batch in batches for track in batch]})
 
 @app.route('/playlists', methods=['GET'])
-def get_playlists():
+@cached(PLAYLISTS_CACHE_TTL)
+async def get_playlists():
     """
-    Endpoint to retrieve the current user's playlists.
+    Endpoint to retrieve all of the current user's playlists.
+    The first page reveals the total count; the remaining pages are then fetched concurrently.
     """
-    # Verify authentication.
-    authenticated, _ = require_authentication()
-    if not authenticated:
-        return jsonify({'error': 'User not authenticated. Please log in via /login.'}), 401
+    # The token was checked and stored on g by check_authentication.
+    token_info = g.token_info
 
-    # Fetch the user's playlists using the Spotify API.
-    playlists = sp.current_user_playlists()
-    return jsonify(playlists)
+    async def fetch_page(offset):
+        # Bound the number of page requests in flight, to avoid being rate limited.
+        async with _playlists_semaphore:
+            return await spotify_request('GET', '/me/playlists', token_info,
+                                         params={'limit': PLAYLISTS_PAGE_SIZE, 'offset': offset})
+
+    try:
+        # Fetch the first page of the user's playlists using the Spotify API.
+        playlists = await fetch_page(0)
+        # Fetch every remaining page at once; gather keeps them in offset order.
+        pages = await asyncio.gather(*(
+            fetch_page(offset) for offset in range(PLAYLISTS_PAGE_SIZE, playlists['total'], PLAYLISTS_PAGE_SIZE)
+        ))
+    except SpotifyAPIError as e:
+        return fastjson({'error': str(e)}, 400)
+
+    # Return the first page's envelope with every playlist merged into its items.
+    for page in pages:
+        playlists['items'].extend(page['items'])
+    playlists['next'] = None
+    return fastjson(playlists)
 
 @app.route('/playlists/<id>/tracks', methods=['POST'])
-def add_to_playlist(id):
+async def add_to_playlist(id):
     """
     Endpoint to add tracks to a specified playlist.
     The request must include a JSON payload with a 'track_ids' list.
     """
-    # Check for a valid authentication token.
-    authenticated, _ = require_authentication()
-    if not authenticated:
-        return jsonify({'error': 'User not authenticated. Please log in via /login.'}), 401
+    # The token was checked and stored on g by check_authentication.
+    token_info = g.token_info
 
-    # Extract the list of track IDs from the request JSON payload.
-    track_ids = request.json.get('track_ids')
-    if not track_ids:
-        return jsonify({'error': 'Missing track_ids parameter'}), 400
+    # Parse and validate the list of track IDs from the request JSON payload in one pass.
+    try:
+        body = PlaylistTracksRequest.model_validate_json(await request.get_data())
+    except ValidationError as e:
+        return invalid_body(e)
 
     try:
         # Use the Spotify API to add the provided track IDs to the specified playlist.
-        sp.playlist_add_items(id, track_ids)
-        return jsonify({'status': 'success'})
-    except spotipy.exceptions.SpotifyException as e:
+        await spotify_request('POST', f'/playlists/{id}/tracks', token_info,
+                              json={'uris': [track_uri(track_id) for track_id in body.track_ids]})
+        return fastjson({'status': 'success'})
+    except SpotifyAPIError as e:
         # If an error occurs during the API call, return the error details.
-        return jsonify({'error': str(e)}), 400
+        return fastjson({'error': str(e)}, 400)
 
 @app.route('/play', methods=['PUT'])
-def play_song():
+async def play_song():
     """
     Endpoint to start playback of a specified track.
     The request must include a JSON payload with a 'track_id'.
     """
-    # Confirm that the user is authenticated.
-    authenticated, _ = require_authentication()
-    if not authenticated:
-        return jsonify({'error': 'User not authenticated. Please log in via /login.'}), 401
+    # The token was checked and stored on g by check_authentication.
+    token_info = g.token_info
 
-    # Retrieve the track ID from the JSON payload.
-    track_id = request.json.get('track_id')
-    if not track_id:
-        return jsonify({'error': 'Missing track_id parameter'}), 400
+    # Parse and validate the track ID from the JSON payload, rejecting malformed IDs before calling Spotify.
+    try:
+        body = PlayRequest.model_validate_json(await request.get_data())
+    except ValidationError as e:
+        return invalid_body(e)
 
     try:
         # Initiate playback for the specified track using its Spotify URI.
-        sp.start_playback(uris=[f'spotify:track:{track_id}'])
-        return jsonify({'status': 'success'})
-    except spotipy.exceptions.SpotifyException as e:
-        return jsonify({'error': str(e)}), 400
+        await spotify_request('PUT', '/me/player/play', token_info, json={'uris': [track_uri(body.track_id)]})
+        return fastjson({'status': 'success'})
+    except SpotifyAPIError as e:
+        return fastjson({'error': str(e)}, 400)
 
 @app.route('/queue', methods=['POST'])
-def queue_song():
+async def queue_song():
     """
     Endpoint to add a track to the user's playback queue.
     The request must include a JSON payload with a 'track_id'.
     """
-    # Ensure the user is authenticated.
-    authenticated, _ = require_authentication()
-    if not authenticated:
-        return jsonify({'error': 'User not authenticated. Please log in via /login.'}), 401
+    # The token was checked and stored on g by check_authentication.
+    token_info = g.token_info
 
-    # Extract the track ID from the request JSON payload.
-    track_id = request.json.get('track_id')
-    if not track_id:
-        return jsonify({'error': 'Missing track_id parameter'}), 400
+    # Parse and validate the track ID from the request JSON payload.
+    try:
+        body = QueueRequest.model_validate_json(await request.get_data())
+    except ValidationError as e:
+        return invalid_body(e)
 
     try:
         # Add the track to the user's playback queue.
-        sp.add_to_queue(track_id)
-        return jsonify({'status': 'success'})
-    except spotipy.exceptions.SpotifyException as e:
-        return jsonify({'error': str(e)}), 400
+        await spotify_request('POST', '/me/player/queue', token_info, params={'uri': track_uri(body.track_id)})
+        return fastjson({'status': 'success'})
+    except SpotifyAPIError as e:
+        return fastjson({'error': str(e)}, 400)
 
 if __name__ == '__main__':
     """
-    Entry point for running the Flask development server.
+    Entry point for running the Quart development server.
     - The server runs on port 5000.
     - Debug mode is enabled to provide detailed error logs.
     - The reloader is disabled to avoid conflicts with Spotipy's OAuth local server.
+    For production, run the app under Hypercorn on uvloop instead: `hypercorn --config hypercorn.toml app:app`.
+    This is the supported deployment; gunicorn.conf.py is only for hosts that must run everything under Gunicorn.
     """
     app.run(debug=True, use_reloader=False)
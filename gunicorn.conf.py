@@ -0,0 +1,11 @@
+# Gunicorn configuration for running AuxAI where Gunicorn is the standard process manager: `gunicorn app:app`.
+# The supported production server is Hypercorn (see hypercorn.toml); this file is the alternative.
+# The app is async (Quart/ASGI), so each worker runs an asyncio event loop through Uvicorn's worker class.
+import multiprocessing  # Import multiprocessing to size the worker pool from the CPU count.
+
+# Address the server listens on.
+bind = '0.0.0.0:5000'
+# One event loop per worker; the usual 2 * CPUs + 1 sizing.
+workers = 2 * multiprocessing.cpu_count() + 1
+# ASGI worker class, so handlers can await Spotify calls instead of blocking a worker.
+worker_class = 'uvicorn_worker.UvicornWorker'
@@ -0,0 +1,11 @@
+import os  # Import os to provide the configuration app.py reads at import time.
+import sys  # Import sys to make app.py importable from the tests directory.
+
+# app.py builds its SpotifyOAuth manager on import, which requires these settings.
+os.environ.setdefault('SPOTIPY_CLIENT_ID', 'test-client-id')
+os.environ.setdefault('SPOTIPY_CLIENT_SECRET', 'test-client-secret')
+os.environ.setdefault('SPOTIPY_REDIRECT_URI', 'http://localhost:5000/callback')
+# Keep the tests independent of any Redis server.
+os.environ.pop('REDIS_URL', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,463 @@
+import asyncio  # Import asyncio to drive Quart's async test client from plain pytest tests.
+import time  # Import time to build a token that is still valid.
+
+import httpx  # Import httpx to stand in for the Spotify Web API with a mock transport.
+import pytest  # Import pytest for parametrized tests.
+
+import app as auxai  # Import the application module under test.
+
+
+@pytest.fixture(autouse=True)
+def token_file_lock(monkeypatch, tmp_path):
+    """
+    Keep the shared token lock file out of the working tree.
+    """
+    monkeypatch.setattr(auxai, 'token_file_lock', auxai.FileLock(str(tmp_path / '.cache.lock')))
+
+
+@pytest.fixture(autouse=True)
+def authenticated():
+    """
+    Put a valid token in the in-process cache so check_authentication lets requests through.
+    """
+    auxai.store_token({'access_token': 'token', 'refresh_token': 'refresh', 'expires_at': int(time.time()) + 3600})
+    yield
+    auxai.store_token(None)
+
+
+@pytest.fixture
+def spotify(monkeypatch):
+    """
+    Route the app's Spotify calls to a fake API.
+    Set `spotify.handler` to a function taking an httpx.Request and returning an httpx.Response;
+    every request sent is recorded in `spotify.requests`.
+    """
+    class FakeSpotify:
+        def __init__(self):
+            self.requests = []
+            self.handler = lambda request: httpx.Response(200, json={})
+
+        def __call__(self, request):
+            self.requests.append(request)
+            return self.handler(request)
+
+    fake = FakeSpotify()
+    monkeypatch.setattr(auxai.app, 'spotify_client',
+                        httpx.AsyncClient(base_url=auxai.SPOTIFY_API_BASE, transport=httpx.MockTransport(fake)),
+                        raising=False)
+    # Retries should not slow the tests down.
+    monkeypatch.setattr(auxai, 'SPOTIFY_BACKOFF_FACTOR', 0)
+    return fake
+
+
+async def send(method, path, data):
+    client = auxai.app.test_client()
+    return await client.open(path, method=method, data=data, headers={'Content-Type': 'application/json'})
+
+
+def get(path):
+    """
+    Send a GET request to the app and return (status code, decoded JSON body).
+    """
+    async def run():
+        response = await auxai.app.test_client().get(path)
+        return response.status_code, await response.get_json()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('method, path', [
+    ('PUT', '/play'),
+    ('POST', '/queue'),
+    ('POST', '/playlists/playlist/tracks'),
+])
+@pytest.mark.parametrize('data', [b'', b'not json', b'\xff\xfe', b'{}'])
+def test_invalid_body_is_rejected_with_400(method, path, data):
+    response = asyncio.run(send(method, path, data))
+    assert response.status_code == 400
+    body = asyncio.run(response.get_json())
+    assert body['error'] == 'Invalid request body'
+    # The client's raw body is never echoed back.
+    assert all('input' not in detail for detail in body['details'])
+
+
+@pytest.mark.parametrize('method, path, data', [
+    ('PUT', '/play', b'{"track_id": "short"}'),
+    ('POST', '/queue', b'{"track_id": "spotify:track:short"}'),
+    ('POST', '/playlists/playlist/tracks', b'{"track_ids": ["4uLU6hMCjMI75M1A2tKUQC", "bad"]}'),
+])
+def test_malformed_track_id_is_rejected_with_400(method, path, data):
+    response = asyncio.run(send(method, path, data))
+    assert response.status_code == 400
+
+
+def test_track_ids_and_uris_are_both_accepted():
+    track_id = '4uLU6hMCjMI75M1A2tKUQC'
+    for model, body in [
+        (auxai.PlayRequest, {'track_id': track_id}),
+        (auxai.PlayRequest, {'track_id': 'spotify:track:' + track_id}),
+        (auxai.QueueRequest, {'track_id': 'spotify:track:' + track_id}),
+        (auxai.PlaylistTracksRequest, {'track_ids': [track_id, 'spotify:track:' + track_id]}),
+    ]:
+        model.model_validate(body)
+
+
+TRACK_ID = '4uLU6hMCjMI75M1A2tKUQC'
+
+
+def test_track_details_accepts_uri(spotify):
+    spotify.handler = lambda request: httpx.Response(200, json={'id': TRACK_ID})
+    status, body = get(f'/track/spotify:track:{TRACK_ID}')
+    assert status == 200
+    assert spotify.requests[0].url.path == f'/v1/tracks/{TRACK_ID}'
+
+
+def test_several_tracks_normalizes_uris_and_rejects_malformed_ids(spotify):
+    spotify.handler = lambda request: httpx.Response(200, json={'tracks': []})
+    status, _ = get(f'/tracks?ids=spotify:track:{TRACK_ID},{TRACK_ID}')
+    assert status == 200
+    assert spotify.requests[0].url.params['ids'] == f'{TRACK_ID},{TRACK_ID}'
+
+    status, _ = get(f'/tracks?ids={TRACK_ID},bad')
+    assert status == 400
+    assert len(spotify.requests) == 1
+
+
+class FakeRedis:
+    """
+    Minimal in-memory stand-in for the async Redis client used by the response cache.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    async def hgetall(self, key):
+        return self.data.get(key, {})
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """
+    Queues hset/expire calls and applies them to the FakeRedis on execute().
+    """
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def hset(self, key, mapping):
+        self.commands.append(('hset', key, mapping))
+
+    def expire(self, key, ttl):
+        self.commands.append(('expire', key, ttl))
+
+    async def execute(self):
+        for command, key, value in self.commands:
+            if command == 'hset':
+                # Redis hands hash fields and values back as bytes.
+                self.redis.data[key] = {
+                    field.encode(): item if isinstance(item, bytes) else item.encode()
+                    for field, item in value.items()
+                }
+            else:
+                self.redis.ttls[key] = value
+
+
+def call_cached(handler, refresh_token, path='/search?q=song'):
+    """
+    Call `handler` wrapped in cached() inside a request for `path`, logged in with `refresh_token`.
+    """
+    async def run():
+        async with auxai.app.test_request_context(path):
+            auxai.g.token_info = {'access_token': 'token', 'refresh_token': refresh_token}
+            response = await auxai.cached(60)(handler)()
+            return response.status_code, await response.get_data()
+    return asyncio.run(run())
+
+
+def test_cached_stores_only_successful_responses(monkeypatch):
+    redis_conn = FakeRedis()
+    monkeypatch.setattr(auxai, 'redis_conn', redis_conn)
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        return auxai.fastjson({'error': 'boom'}, 400)
+
+    async def succeeding():
+        calls.append(1)
+        return auxai.fastjson({'ok': True})
+
+    assert call_cached(failing, 'refresh')[0] == 400
+    assert redis_conn.data == {}
+
+    assert call_cached(succeeding, 'refresh') == (200, b'{"ok":true}')
+    # The second call is served from the cache without running the handler.
+    assert call_cached(succeeding, 'refresh') == (200, b'{"ok":true}')
+    assert len(calls) == 2
+    assert len(redis_conn.data) == 1
+
+
+def test_cached_keys_responses_by_account(monkeypatch):
+    redis_conn = FakeRedis()
+    monkeypatch.setattr(auxai, 'redis_conn', redis_conn)
+
+    async def handler():
+        return auxai.fastjson({'ok': True})
+
+    call_cached(handler, 'first-account')
+    call_cached(handler, 'second-account')
+    assert len(redis_conn.data) == 2
+    # The refresh token itself never appears in the keys.
+    assert not any('account' in key for key in redis_conn.data)
+
+
+def spotify_call(method, path, **kwargs):
+    """
+    Run spotify_request with the test token and return its result.
+    """
+    token_info = {'access_token': 'token', 'refresh_token': 'refresh', 'expires_at': int(time.time()) + 3600}
+    return asyncio.run(auxai.spotify_request(method, path, token_info, **kwargs))
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Record the delays spotify_request sleeps for, without actually waiting.
+    """
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(auxai.asyncio, 'sleep', sleep)
+    return delays
+
+
+def test_gateway_errors_are_not_retried_for_post(spotify, sleeps):
+    spotify.handler = lambda request: httpx.Response(502)
+    with pytest.raises(auxai.SpotifyAPIError):
+        spotify_call('POST', '/me/player/queue', params={'uri': 'spotify:track:' + TRACK_ID})
+    assert len(spotify.requests) == 1
+
+
+def test_gateway_errors_are_retried_for_get(spotify, sleeps):
+    responses = [httpx.Response(502), httpx.Response(503), httpx.Response(200, json={'ok': True})]
+    spotify.handler = lambda request: responses.pop(0)
+    assert spotify_call('GET', '/me') == {'ok': True}
+    assert len(spotify.requests) == 3
+
+
+def test_rate_limit_waits_for_retry_after(spotify, sleeps):
+    responses = [httpx.Response(429, headers={'Retry-After': '3'}), httpx.Response(204)]
+    spotify.handler = lambda request: responses.pop(0)
+    assert spotify_call('POST', '/me/player/queue') is None
+    assert sleeps == [3]
+
+
+def test_rate_limit_with_long_retry_after_is_not_retried(spotify, sleeps):
+    spotify.handler = lambda request: httpx.Response(429, headers={'Retry-After': '30'})
+    with pytest.raises(auxai.SpotifyAPIError) as error:
+        spotify_call('GET', '/me')
+    assert error.value.status == 429
+    assert len(spotify.requests) == 1
+    assert sleeps == []
+
+
+def playlists_page(request):
+    """
+    Fake /me/playlists: 120 playlists, numbered by position, served in pages.
+    """
+    offset, limit = int(request.url.params['offset']), int(request.url.params['limit'])
+    items = [{'id': str(i)} for i in range(offset, min(offset + limit, 120))]
+    return {'total': 120, 'items': items, 'next': 'next-page-url'}
+
+
+def test_playlists_merges_pages_in_offset_order(spotify):
+    async def handler(request):
+        # Later pages answer first, so the order must come from the offsets, not from completion.
+        await asyncio.sleep(0.01 * (120 - int(request.url.params['offset'])) / 50)
+        return httpx.Response(200, json=playlists_page(request))
+
+    spotify.handler = handler
+    status, body = get('/playlists')
+    assert status == 200
+    assert [item['id'] for item in body['items']] == [str(i) for i in range(120)]
+    assert body['next'] is None
+    assert len(spotify.requests) == 3
+
+
+def test_playlists_error_on_one_page_returns_400(spotify):
+    def handler(request):
+        if request.url.params['offset'] == '50':
+            return httpx.Response(404, json={'error': {'status': 404, 'message': 'Not found'}})
+        return httpx.Response(200, json=playlists_page(request))
+
+    spotify.handler = handler
+    status, body = get('/playlists')
+    assert status == 400
+    assert 'Not found' in body['error']
+
+
+def test_several_tracks_rejects_too_many_ids(spotify):
+    status, _ = get('/tracks?ids=' + ','.join([TRACK_ID] * (auxai.TRACKS_MAX_IDS + 1)))
+    assert status == 400
+    assert spotify.requests == []
+
+
+def test_several_tracks_returns_batches_in_order(spotify):
+    track_ids = [f'{i:022d}' for i in range(120)]
+
+    async def handler(request):
+        ids = request.url.params['ids'].split(',')
+        # Later batches answer first.
+        await asyncio.sleep(0.01 * (120 - int(ids[0])) / 50)
+        return httpx.Response(200, json={'tracks': [{'id': track_id} for track_id in ids]})
+
+    spotify.handler = handler
+    status, body = get('/tracks?ids=' + ','.join(track_ids))
+    assert status == 200
+    assert [track['id'] for track in body['tracks']] == track_ids
+    assert [len(request.url.params['ids'].split(',')) for request in spotify.requests] == [50, 50, 20]
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    """
+    Replace the OAuth refresh with a fake that hands out 'new-token' and records each call.
+    """
+    calls = []
+
+    def refresh_access_token(refresh_token):
+        calls.append(refresh_token)
+        return {'access_token': 'new-token', 'refresh_token': refresh_token, 'expires_at': int(time.time()) + 3600}
+
+    monkeypatch.setattr(auxai.sp_oauth, 'refresh_access_token', refresh_access_token)
+    # No other worker has refreshed the shared cache.
+    monkeypatch.setattr(auxai.sp_oauth.cache_handler, 'get_cached_token', lambda: None)
+    return calls
+
+
+def test_401_refreshes_the_token_and_retries(spotify, refreshes):
+    spotify.handler = lambda request: (
+        httpx.Response(200, json={'ok': True}) if request.headers['Authorization'] == 'Bearer new-token'
+        else httpx.Response(401, json={'error': {'status': 401, 'message': 'The access token expired'}})
+    )
+    assert spotify_call('GET', '/me') == {'ok': True}
+    assert refreshes == ['refresh']
+    assert len(spotify.requests) == 2
+
+
+def test_401_after_exhausted_retries_still_refreshes(spotify, sleeps, refreshes):
+    responses = [httpx.Response(429)] * auxai.SPOTIFY_MAX_RETRIES + [httpx.Response(401), httpx.Response(200, json={'ok': True})]
+    spotify.handler = lambda request: responses.pop(0)
+    assert spotify_call('GET', '/me') == {'ok': True}
+    assert refreshes == ['refresh']
+
+
+def test_second_401_is_raised(spotify, refreshes):
+    spotify.handler = lambda request: httpx.Response(401, json={'error': {'status': 401, 'message': 'Invalid'}})
+    with pytest.raises(auxai.SpotifyAPIError) as error:
+        spotify_call('GET', '/me')
+    assert error.value.status == 401
+    assert refreshes == ['refresh']
+
+
+def test_concurrent_401s_share_one_refresh(spotify, refreshes):
+    track_ids = [f'{i:022d}' for i in range(120)]
+    spotify.handler = lambda request: (
+        httpx.Response(200, json={'tracks': []}) if request.headers['Authorization'] == 'Bearer new-token'
+        else httpx.Response(401)
+    )
+    status, _ = get('/tracks?ids=' + ','.join(track_ids))
+    assert status == 200
+    assert refreshes == ['refresh']
+
+
+def test_revoked_refresh_token_returns_401(spotify, monkeypatch):
+    def refresh_access_token(refresh_token):
+        raise auxai.SpotifyOauthError('invalid_grant')
+
+    monkeypatch.setattr(auxai.sp_oauth, 'refresh_access_token', refresh_access_token)
+    monkeypatch.setattr(auxai.sp_oauth.cache_handler, 'get_cached_token', lambda: None)
+    spotify.handler = lambda request: httpx.Response(401)
+    status, body = get('/playlists')
+    assert status == 401
+    assert 'log in' in body['error']
+
+
+def test_non_json_error_uses_reason_phrase(spotify):
+    spotify.handler = lambda request: httpx.Response(500, text='<html>Server Error</html>')
+    with pytest.raises(auxai.SpotifyAPIError) as error:
+        spotify_call('GET', '/me')
+    assert error.value.status == 500
+    assert error.value.message == 'Internal Server Error'
+
+
+def test_unchanged_resource_is_revalidated_with_etag(spotify, monkeypatch):
+    redis_conn = FakeRedis()
+    monkeypatch.setattr(auxai, 'redis_conn', redis_conn)
+
+    def handler(request):
+        if request.headers.get('If-None-Match') == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json={'id': TRACK_ID}, headers={'ETag': '"v1"'})
+
+    spotify.handler = handler
+    assert spotify_call('GET', f'/tracks/{TRACK_ID}') == {'id': TRACK_ID}
+    assert spotify_call('GET', f'/tracks/{TRACK_ID}') == {'id': TRACK_ID}
+    assert 'If-None-Match' not in spotify.requests[0].headers
+    assert spotify.requests[1].headers['If-None-Match'] == '"v1"'
+    # The stored entry always carries a TTL longer than any response cache.
+    assert all(ttl > auxai.TRACK_CACHE_TTL for ttl in redis_conn.ttls.values())
+
+
+def run_refresher_once(monkeypatch):
+    """
+    Run refresh_token_periodically until its first sleep, then stop it.
+    """
+    async def sleep(delay):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(auxai.asyncio, 'sleep', sleep)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(auxai.refresh_token_periodically())
+
+
+def test_refresher_adopts_token_refreshed_by_another_worker(monkeypatch, refreshes):
+    auxai.store_token({'access_token': 'old', 'refresh_token': 'refresh', 'expires_at': int(time.time()) + 30})
+    newer = {'access_token': 'other-worker', 'refresh_token': 'refresh', 'expires_at': int(time.time()) + 3600}
+    monkeypatch.setattr(auxai.sp_oauth.cache_handler, 'get_cached_token', lambda: newer)
+    run_refresher_once(monkeypatch)
+    assert refreshes == []
+    assert auxai._TOKEN_CACHE['info'] == newer
+
+
+def test_refresher_drops_a_revoked_refresh_token(monkeypatch):
+    calls = []
+
+    def refresh_access_token(refresh_token):
+        calls.append(refresh_token)
+        raise auxai.SpotifyOauthError('invalid_grant')
+
+    monkeypatch.setattr(auxai.sp_oauth, 'refresh_access_token', refresh_access_token)
+    monkeypatch.setattr(auxai.sp_oauth.cache_handler, 'get_cached_token', lambda: None)
+    auxai.store_token({'access_token': 'old', 'refresh_token': 'refresh', 'expires_at': int(time.time()) + 30})
+    run_refresher_once(monkeypatch)
+    assert calls == ['refresh']
+    # The token is dropped, so the task waits for a new login instead of retrying it.
+    assert auxai._TOKEN_CACHE['info'] is None